@@ -1,23 +1,44 @@
+import asyncio
+import atexit
 import logging
+import logging.handlers
 import os
-import json
-from functools import wraps
+import queue
+import re
+import time
+import hashlib
+from collections import OrderedDict
+
+import httpx
+import numpy as np
+import orjson
 
 # LLM-related imports
 import google.generativeai as genai
 from gigachat import GigaChat
 from openai import AsyncOpenAI
 
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from telegram.error import BadRequest
+from telegram.ext import (
+    AIORateLimiter, ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters,
+    CallbackQueryHandler, PersistenceInput, PicklePersistence,
+)
+from telegram.error import BadRequest, TelegramError
 from telegram.constants import ParseMode
 
 # Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Records are only queued on the event loop; a background thread writes them to stderr.
+log_queue = queue.SimpleQueue()
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_stream_handler)
+logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+logging.getLogger().setLevel(logging.INFO)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # --- Environment Variable Configuration ---
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -29,53 +50,337 @@ except (TypeError, ValueError):
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable not set.")
 
+# Chat mode, state and the pending Training text survive restarts in this file
+STATE_FILE = os.getenv("BOT_STATE_FILE", "bot_state.pickle")
+
+# --- System Prompts ---
+# Kept as constants so the prefix sent to the provider is byte-for-byte stable
+# between calls, which lets provider-side prompt caching reuse it.
+_SYS_TRAINING = """Дано предложение или фраза.
+Задача: составить текст на английском языке, состоящий из 3-5 предложений, содержащий данное предложение или фразу. Стиль - неформальный, разговорный, можно диалог. Также перевести текст на русский язык.
+Результат должен быть строго в формате:
+===RU===
+<Текст на русском>
+===EN===
+<Текст на английском>
+Предложение: """
+
+_SYS_ENGLISH_ONLY = """Given a sentence or a phrase.
+Task: create a text in English, consisting of 3-5 sentences, containing the given sentence or phrase.
+The result should be only the generated English text, without any other formatting or labels."""
+
+_SYS_EXPLAIN = """You are an English teacher. The user will provide a word or a phrase.
+Your task is to explain its meaning in simple English. Provide a clear definition and 2-3 examples of modern use.
+Format the response as plain text using only these markers:
+- Wrap the main word/phrase in <b> and </b>.
+- Wrap words to emphasize in <i> and </i>.
+- Use bullet points starting with a hyphen '-'.
+Do not use Markdown and do not escape any characters."""
+
+
 # --- LLM Provider Configuration ---
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "DEEPSEEK").upper()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GIGACHAT_CREDENTIALS = os.getenv("GIGACHAT_CREDENTIALS")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 
-gemini_model = None
+gemini_models = {}
+gigachat_client = None
 deepseek_client = None
+llm_http_client = None
 
 if LLM_PROVIDER == "GEMINI":
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY environment variable not set for GEMINI provider.")
     genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel('gemini-3-flash-preview')
+    # System instructions are passed separately so Gemini can cache them
+    gemini_models = {
+        prompt: genai.GenerativeModel('gemini-3-flash-preview', system_instruction=prompt)
+        for prompt in (_SYS_TRAINING, _SYS_ENGLISH_ONLY, _SYS_EXPLAIN)
+    }
     logging.info("Using GEMINI as LLM provider.")
 elif LLM_PROVIDER == "GIGACHAT":
     if not GIGACHAT_CREDENTIALS:
         raise ValueError("GIGACHAT_CREDENTIALS environment variable not set for GIGACHAT provider.")
+    # One long-lived client keeps the connection and OAuth token warm between requests
+    gigachat_client = GigaChat(credentials=GIGACHAT_CREDENTIALS, verify_ssl_certs=False)
     logging.info("Using GIGACHAT as LLM provider.")
 elif LLM_PROVIDER == "DEEPSEEK":
     if not DEEPSEEK_API_KEY:
         raise ValueError("DEEPSEEK_API_KEY environment variable not set for DEEPSEEK provider.")
-    deepseek_client = AsyncOpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
+    # HTTP/2 keeps concurrent requests multiplexed over one warm TLS connection
+    llm_http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(60.0),
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+    )
+    deepseek_client = AsyncOpenAI(
+        api_key=DEEPSEEK_API_KEY,
+        base_url="https://api.deepseek.com",
+        http_client=llm_http_client,
+    )
     logging.info("Using DEEPSEEK as LLM provider.")
 else:
     raise ValueError(f"Unknown LLM_PROVIDER: {LLM_PROVIDER}. Use 'GEMINI', 'GIGACHAT', or 'DEEPSEEK'.")
 
 
+# --- Redis Configuration ---
+# When REDIS_URL is set, cached responses outlive restarts and are shared between processes.
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_CACHE_TTL = int(os.getenv("REDIS_CACHE_TTL", "86400"))
+
+redis_client = None
+if REDIS_URL:
+    redis_client = Redis.from_url(REDIS_URL, decode_responses=True, max_connections=16)
+    logging.info("Using Redis to persist the LLM response cache.")
+
+
+# --- LLM Response Cache ---
+LLM_CACHE_SIZE = 512
+llm_cache = OrderedDict()
+cache_stats = {"hits": 0, "semantic_hits": 0, "misses": 0}
+
+
+def cache_key(system_prompt: str, user_message: str) -> str:
+    """Builds a stable cache key for a prompt sent to the current provider."""
+    payload = orjson.dumps([LLM_PROVIDER, system_prompt, user_message])
+    return hashlib.sha256(payload).hexdigest()
+
+
+def cache_store(key: str, response_text: str):
+    """Stores a response in the exact-match cache, evicting the oldest entry."""
+    llm_cache[key] = response_text
+    if len(llm_cache) > LLM_CACHE_SIZE:
+        llm_cache.popitem(last=False)
+
+
+async def redis_cache_get(key: str):
+    """Returns a response persisted in Redis, or None."""
+    if redis_client is None:
+        return None
+    try:
+        return await redis_client.get(f"llm:{key}")
+    except RedisError as e:
+        logging.warning(f"Redis cache read failed: {e}")
+        return None
+
+
+async def redis_cache_set(key: str, response_text: str):
+    """Persists a response in Redis with the cache TTL."""
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(f"llm:{key}", response_text, ex=REDIS_CACHE_TTL)
+    except RedisError as e:
+        logging.warning(f"Redis cache write failed: {e}")
+
+
+# --- Semantic Cache ---
+# Paraphrased phrases reuse an earlier response when their embeddings are close enough.
+# Entries are kept per (provider, system prompt) so that modes never share answers.
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = 512
+# Single words and two-word phrases ("affect"/"effect", "run out"/"run away") embed too close
+# together to tell apart, so they only use the exact-match cache.
+SEMANTIC_CACHE_MIN_WORDS = 3
+# Training and English Only texts must contain the user's exact phrase, so a text generated
+# for a paraphrase is only reused when it happens to contain this phrase too.
+SEMANTIC_PHRASE_REQUIRED = {_SYS_TRAINING, _SYS_ENGLISH_ONLY}
+semantic_cache = {}
+semantic_loaded = set()
+
+
+async def embed_text(text: str):
+    """
+    Returns a normalized embedding of the text, or None if the provider has no embeddings API.
+    """
+    if LLM_PROVIDER == "GEMINI":
+        result = await genai.embed_content_async(model="models/text-embedding-004", content=text)
+        vector = result["embedding"]
+    elif LLM_PROVIDER == "GIGACHAT":
+        result = await gigachat_client.aembeddings([text])
+        vector = result.data[0].embedding
+    else:
+        # DeepSeek does not provide an embeddings endpoint
+        return None
+
+    embedding = np.asarray(vector, dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+
+def semantic_lookup(namespace: tuple, embedding: np.ndarray):
+    """Returns the cached response most similar to the embedding, if it passes the threshold."""
+    entry = semantic_cache.get(namespace)
+    if entry is None:
+        return None
+
+    similarities = entry["embeddings"] @ embedding
+    index = int(np.argmax(similarities))
+    if similarities[index] >= SEMANTIC_CACHE_THRESHOLD:
+        return entry["responses"][index]
+    return None
+
+
+def semantic_store(namespace: tuple, embedding: np.ndarray, response_text: str):
+    """Appends a response to the semantic cache, dropping the oldest entries past the limit."""
+    entry = semantic_cache.setdefault(namespace, {
+        "embeddings": np.empty((0, embedding.shape[0]), dtype=np.float32),
+        "responses": [],
+    })
+    entry["embeddings"] = np.vstack([entry["embeddings"], embedding])[-SEMANTIC_CACHE_SIZE:]
+    entry["responses"] = (entry["responses"] + [response_text])[-SEMANTIC_CACHE_SIZE:]
+
+
+def semantic_redis_key(namespace: tuple) -> str:
+    """Returns the Redis list holding the semantic cache entries of a namespace."""
+    return "llm:semantic:" + hashlib.sha256(orjson.dumps(list(namespace))).hexdigest()
+
+
+async def semantic_load(namespace: tuple):
+    """Restores a semantic cache namespace from Redis the first time it is used."""
+    if redis_client is None or namespace in semantic_loaded:
+        return
+    try:
+        entries = await redis_client.lrange(semantic_redis_key(namespace), 0, -1)
+    except RedisError as e:
+        # The namespace stays unloaded so the next request retries the read
+        logging.warning(f"Redis semantic cache read failed: {e}")
+        return
+    if namespace in semantic_loaded:
+        # Another request loaded it while this one was waiting for Redis
+        return
+    semantic_loaded.add(namespace)
+
+    oldest_time = time.time() - REDIS_CACHE_TTL
+    for raw_entry in entries:
+        try:
+            entry = orjson.loads(raw_entry)
+            if entry["time"] < oldest_time:
+                continue
+            semantic_store(namespace, np.asarray(entry["embedding"], dtype=np.float32), entry["response"])
+        except (KeyError, TypeError, ValueError) as e:
+            # Corrupt entries, or entries from an embedding model of another size
+            logging.warning(f"Skipping unreadable semantic cache entry: {e}")
+
+
+async def semantic_persist(namespace: tuple, embedding: np.ndarray, response_text: str):
+    """
+    Appends a semantic cache entry to Redis, keeping the newest entries.
+    Each entry carries its creation time so entries older than REDIS_CACHE_TTL are dropped on load;
+    the list's own TTL only removes namespaces that are no longer written to.
+    """
+    if redis_client is None:
+        return
+    redis_key = semantic_redis_key(namespace)
+    entry = orjson.dumps(
+        {"embedding": embedding, "response": response_text, "time": time.time()},
+        option=orjson.OPT_SERIALIZE_NUMPY,
+    )
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.rpush(redis_key, entry)
+            pipe.ltrim(redis_key, -SEMANTIC_CACHE_SIZE, -1)
+            pipe.expire(redis_key, REDIS_CACHE_TTL)
+            await pipe.execute()
+    except RedisError as e:
+        logging.warning(f"Redis semantic cache write failed: {e}")
+
+
 # --- Generic LLM Response Function ---
-async def generate_llm_response(system_prompt: str, user_message: str) -> str:
+async def generate_llm_response(system_prompt: str, user_message: str, phrase: str = None,
+                                on_chunk=None, validate=None) -> str:
     """
-    Generates a response from the configured LLM provider.
+    Returns a cached response for an identical or paraphrased prompt, otherwise asks the LLM.
+    phrase is the user's own text without the prompt prefix; it is what the semantic cache compares.
+    If on_chunk is given, the LLM response is streamed and each text chunk is awaited with it.
+    If validate is given, it is called with a new LLM response and may raise to reject it;
+    rejected responses are not cached.
     """
-    messages = [
-        {"role": "system", "content": system_prompt},
+    key = cache_key(system_prompt, user_message)
+    if key in llm_cache:
+        cache_stats["hits"] += 1
+        llm_cache.move_to_end(key)
+        return llm_cache[key]
+
+    return await fetch_llm_response(key, system_prompt, user_message, phrase, on_chunk, validate)
+
+
+async def fetch_llm_response(key: str, system_prompt: str, user_message: str, phrase: str = None,
+                             on_chunk=None, validate=None) -> str:
+    """
+    Looks up the persisted and semantic caches, falling back to the LLM, and caches the result.
+    """
+    cached_text = await redis_cache_get(key)
+    if cached_text is not None:
+        cache_stats["hits"] += 1
+        cache_store(key, cached_text)
+        return cached_text
+
+    namespace = (LLM_PROVIDER, system_prompt)
+    embedding = None
+    if phrase is not None and len(phrase.split()) >= SEMANTIC_CACHE_MIN_WORDS:
+        try:
+            embedding = await embed_text(phrase)
+        except Exception as e:
+            logging.warning(f"Embedding failed, skipping semantic cache: {e}")
+
+    if embedding is not None:
+        await semantic_load(namespace)
+        cached_text = semantic_lookup(namespace, embedding)
+        if (cached_text is not None and system_prompt in SEMANTIC_PHRASE_REQUIRED
+                and phrase.lower() not in cached_text.lower()):
+            cached_text = None
+        if cached_text is not None:
+            cache_stats["semantic_hits"] += 1
+            cache_store(key, cached_text)
+            await redis_cache_set(key, cached_text)
+            return cached_text
+
+    cache_stats["misses"] += 1
+    if on_chunk is None:
+        response_text = await call_llm(system_prompt, user_message)
+    else:
+        response_text = await stream_llm(system_prompt, user_message, on_chunk)
+    if not response_text or not response_text.strip():
+        raise ValueError("LLM returned an empty response.")
+    if validate is not None:
+        validate(response_text)
+    cache_store(key, response_text)
+    await redis_cache_set(key, response_text)
+    if embedding is not None:
+        semantic_store(namespace, embedding, response_text)
+        await semantic_persist(namespace, embedding, response_text)
+    return response_text
+
+
+# System messages are built once per prompt and shared by every request
+_SYSTEM_MESSAGES = {
+    prompt: {"role": "system", "content": prompt}
+    for prompt in (_SYS_TRAINING, _SYS_ENGLISH_ONLY, _SYS_EXPLAIN)
+}
+
+
+def build_messages(system_prompt: str, user_message: str) -> list:
+    """Builds the chat messages for OpenAI-style providers."""
+    # Static system prompt first, variable user text last, to keep the cached prefix intact
+    return [
+        _SYSTEM_MESSAGES[system_prompt],
         {"role": "user", "content": user_message},
     ]
 
+
+async def call_llm(system_prompt: str, user_message: str) -> str:
+    """
+    Generates a response from the configured LLM provider.
+    """
+    messages = build_messages(system_prompt, user_message)
+
     if LLM_PROVIDER == "GEMINI":
-        # Gemini prefers a single combined prompt
-        full_prompt = f"{system_prompt}\n\n{user_message}"
-        response = await gemini_model.generate_content_async(full_prompt)
+        response = await gemini_models[system_prompt].generate_content_async(user_message)
         return response.text
     elif LLM_PROVIDER == "GIGACHAT":
-        async with GigaChat(credentials=GIGACHAT_CREDENTIALS, verify_ssl_certs=False) as client:
-            response = await client.achat(messages=messages)
-            return response.choices[0].message.content
+        response = await gigachat_client.achat({"messages": messages})
+        return response.choices[0].message.content
     elif LLM_PROVIDER == "DEEPSEEK":
         response = await deepseek_client.chat.completions.create(
             model="deepseek-chat",
@@ -86,6 +391,42 @@ async def generate_llm_response(system_prompt: str, user_message: str) -> str:
     return "Error: LLM Provider not configured correctly."
 
 
+async def stream_llm(system_prompt: str, user_message: str, on_chunk) -> str:
+    """
+    Streams a response from the configured LLM provider and returns the full text.
+    """
+    parts = []
+    async for text in iter_llm_chunks(system_prompt, user_message):
+        if text:
+            parts.append(text)
+            await on_chunk(text)
+    return "".join(parts)
+
+
+async def iter_llm_chunks(system_prompt: str, user_message: str):
+    """
+    Yields text chunks of a streamed response from the configured LLM provider.
+    """
+    messages = build_messages(system_prompt, user_message)
+
+    if LLM_PROVIDER == "GEMINI":
+        response = await gemini_models[system_prompt].generate_content_async(user_message, stream=True)
+        async for chunk in response:
+            yield chunk.text
+    elif LLM_PROVIDER == "GIGACHAT":
+        async for chunk in gigachat_client.astream({"messages": messages}):
+            yield chunk.choices[0].delta.content
+    elif LLM_PROVIDER == "DEEPSEEK":
+        response = await deepseek_client.chat.completions.create(
+            model="deepseek-chat",
+            messages=messages,
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content
+
+
 # --- Mode and State definitions ---
 MODE_TRAINING = 'mode_training'
 MODE_ENGLISH_ONLY = 'mode_english_only'
@@ -94,19 +435,14 @@ MODE_EXPLAIN = 'mode_explain'
 STATE_AWAITING_PHRASE = 1
 STATE_AWAITING_REVEAL = 2
 
-# --- Decorator for owner-only access ---
-def owner_only(func):
-    @wraps(func)
-    async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        user = update.effective_user
-        if user.id != OWNER_ID:
-            logging.warning(f"Unauthorized access denied for user {user.id} ({user.username}).")
-            return
-        return await func(update, context, *args, **kwargs)
-    return wrapped
+# The mode keyboard never changes, so it is built once
+_MODE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎓 Training", callback_data=MODE_TRAINING)],
+    [InlineKeyboardButton("🇬🇧 English Only", callback_data=MODE_ENGLISH_ONLY)],
+    [InlineKeyboardButton("🧑‍🏫 Explain", callback_data=MODE_EXPLAIN)],
+])
 
 
-@owner_only
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Starts the conversation and sets the default mode."""
     context.chat_data.clear()
@@ -120,29 +456,71 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
              f"Send me a phrase to begin or use /mode to change it."
     )
 
-@owner_only
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reports LLM response cache statistics."""
+    text = (f"Cache hits: {cache_stats['hits']}, semantic hits: {cache_stats['semantic_hits']}, "
+            f"misses: {cache_stats['misses']}, entries: {len(llm_cache)}/{LLM_CACHE_SIZE}.")
+    logging.info(text)
+    await update.message.reply_text(text)
+
 async def mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Displays mode selection buttons."""
-    keyboard = [
-        [InlineKeyboardButton("🎓 Training", callback_data=MODE_TRAINING)],
-        [InlineKeyboardButton("🇬🇧 English Only", callback_data=MODE_ENGLISH_ONLY)],
-        [InlineKeyboardButton("🧑‍🏫 Explain", callback_data=MODE_EXPLAIN)],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text('Please choose a mode:', reply_markup=reply_markup)
+    await update.message.reply_text('Please choose a mode:', reply_markup=_MODE_MARKUP)
 
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answers the CallbackQuery right away and queues the mode change behind pending messages."""
+    try:
+        await update.callback_query.answer()
+    except TelegramError as e:
+        logging.warning(f"Failed to answer callback query: {e}")
+    await message_queue.put((set_mode, update, context))
+
+
+async def set_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Parses the CallbackQuery and updates the chat mode."""
     query = update.callback_query
-    await query.answer()
-
     context.chat_data['mode'] = query.data
     context.chat_data['state'] = STATE_AWAITING_PHRASE
     await query.edit_message_text(text=f"Mode set to: {query.data}.\nSend me a word or phrase.")
 
 
-@owner_only
+# --- Background message processing ---
+# Updates that touch chat_data are handed to worker tasks so the update is released immediately.
+# Updates of one chat are still processed one at a time, in the order they arrived.
+MESSAGE_WORKERS = int(os.getenv("MESSAGE_WORKERS", "4"))
+message_queue = asyncio.Queue()
+message_workers = []
+chat_locks = {}
+
+
+def queued(callback):
+    """Wraps a handler callback so its updates are processed by the background workers."""
+    async def enqueue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await message_queue.put((callback, update, context))
+    return enqueue
+
+
+async def message_worker():
+    """Takes queued updates and processes them."""
+    while True:
+        callback, update, context = await message_queue.get()
+        try:
+            if update.effective_chat is None:
+                # e.g. callback queries from inline messages, which have no chat_data
+                logging.warning(f"Skipping update {update.update_id} without a chat.")
+                continue
+            chat_id = update.effective_chat.id
+            async with chat_locks.setdefault(chat_id, asyncio.Lock()):
+                await callback(update, context)
+            # chat_data changed after the handler returned, so flag it for persistence again
+            context.application.mark_data_for_update_persistence(chat_ids=chat_id)
+        except Exception as e:
+            logging.error(f"Error in message_worker: {e}")
+        finally:
+            message_queue.task_done()
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Main message handler that delegates to mode- and state-specific handlers."""
     mode = context.chat_data.get('mode', MODE_TRAINING)
@@ -159,25 +537,40 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_explain_mode(update, context)
 
 
+# Matches a Markdown code fence the model sometimes wraps its whole answer in
+_FENCE_RE = re.compile(r"^\s*```\w*|```\s*$")
+
+
+def parse_training_response(response_text: str):
+    """Splits a Training mode response into its Russian and English texts."""
+    cleaned_text = _FENCE_RE.sub("", response_text)
+    russian_text, english_text = cleaned_text.split("===EN===", 1)
+    russian_text = russian_text.replace("===RU===", "").strip()
+    english_text = english_text.strip()
+    if not russian_text or not english_text:
+        raise ValueError("Training response has an empty Russian or English text.")
+    return russian_text, english_text
+
+
 async def handle_phrase_and_return_russian(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generates texts, sends Russian part, stores English part."""
     user_message = update.message.text
     chat_id = update.effective_chat.id
 
-    system_prompt = """Дано предложение или фраза.
-Задача: составить текст на английском языке, состоящий из 3-5 предложений, содержащий данное предложение или фразу. Стиль - неформальный, разговорный, можно диалог. Также перевести текст на русский язык.
-Результат должен быть в формате JSON: {"phrase": "<Исходное предложение>", "russian":"<Текст на русском>", "english":"<Текст на английском>"}
-Предложение: """
-
     try:
-        await context.bot.send_chat_action(chat_id=chat_id, action='typing')
-        response_text = await generate_llm_response(system_prompt, f"Предложение: {user_message}")
+        # The typing indicator and the LLM call are independent round trips
+        _, response_text = await asyncio.gather(
+            context.bot.send_chat_action(chat_id=chat_id, action='typing'),
+            generate_llm_response(
+                _SYS_TRAINING, f"Предложение: {user_message}", phrase=user_message,
+                validate=parse_training_response
+            ),
+        )
         
-        cleaned_text = response_text.strip().lstrip("```json").rstrip("```").strip()
-        data = json.loads(cleaned_text)
+        russian_text, english_text = parse_training_response(response_text)
 
-        context.chat_data['english_text'] = data['english']
-        await context.bot.send_message(chat_id=chat_id, text=data['russian'])
+        context.chat_data['english_text'] = english_text
+        await context.bot.send_message(chat_id=chat_id, text=russian_text)
 
         context.chat_data['state'] = STATE_AWAITING_REVEAL
         await context.bot.send_message(chat_id=chat_id, text="Now, send any message to get the English version.")
@@ -199,20 +592,122 @@ async def handle_reveal_english(update: Update, context: ContextTypes.DEFAULT_TY
     await context.bot.send_message(chat_id=chat_id, text="Let's start over. Send me a new phrase.")
 
 
+# --- MarkdownV2 rendering ---
+# Escaping is done here rather than by the LLM: only the <b>/<i> markers become formatting.
+_MDV2 = str.maketrans({c: "\\" + c for c in "\\_*[]()~`>#+-=|{}.!"})
+_MARKUP_RE = re.compile(r"<(/?)([bi])>")
+_MARKUP_SYMBOLS = {"b": "*", "i": "_"}
+
+
+def to_markdown_v2(text: str) -> str:
+    """
+    Escapes text for MarkdownV2, turning <b> and <i> markers into bold and italic.
+    Markers may nest; empty spans, repeated openings, stray closings and crossed closings
+    are dropped, and markers left open are closed at the end.
+    """
+    parts = []
+    open_markers = []
+    position = 0
+    for match in _MARKUP_RE.finditer(text):
+        if match.start() > position:
+            parts.append(text[position:match.start()].translate(_MDV2))
+        position = match.end()
+        closing, name = match.groups()
+        symbol = _MARKUP_SYMBOLS[name]
+
+        if closing:
+            if open_markers and open_markers[-1] == name:
+                close_marker(parts, open_markers)
+        elif name not in open_markers:
+            if parts and parts[-1] == symbol:
+                # A span of the same kind just closed: merge the two, since "_a__b_" reads as underline
+                parts.pop()
+            else:
+                parts.append(symbol)
+            open_markers.append(name)
+
+    if position < len(text):
+        parts.append(text[position:].translate(_MDV2))
+    while open_markers:
+        close_marker(parts, open_markers)
+    return "".join(parts)
+
+
+def close_marker(parts: list, open_markers: list):
+    """Closes the innermost open marker, dropping its span if nothing was written inside it."""
+    symbol = _MARKUP_SYMBOLS[open_markers.pop()]
+    if parts and parts[-1] == symbol:
+        # "__" would read as underline and "**" as an empty entity
+        parts.pop()
+    else:
+        parts.append(symbol)
+
+
+def strip_markup(text: str) -> str:
+    """Removes the <b> and <i> markers, leaving plain text."""
+    return _MARKUP_RE.sub("", text)
+
+
+# --- Streaming replies ---
+# Telegram allows about one message per second in a chat, edits included.
+STREAM_EDIT_INTERVAL = 1.0
+
+
+async def edit_reply(message, text: str, parse_mode=None):
+    """Edits a bot message, ignoring edits that would not change it."""
+    try:
+        await message.edit_text(text=text, parse_mode=parse_mode)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise e
+
+
+async def stream_reply(context: ContextTypes.DEFAULT_TYPE, chat_id: int, system_prompt: str, user_message: str,
+                       phrase: str, preview=None):
+    """
+    Sends a placeholder message and fills it in while the LLM response is streamed.
+    If preview is given, the partial text is passed through it before each interim edit.
+    Returns the placeholder message and the full response text.
+    If the LLM call fails, the placeholder is deleted before the error is re-raised.
+    """
+    message = await context.bot.send_message(chat_id=chat_id, text="…")
+    loop = asyncio.get_running_loop()
+    parts = []
+    last_edit = loop.time()
+
+    async def on_chunk(text: str):
+        nonlocal last_edit
+        parts.append(text)
+        if loop.time() - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        last_edit = loop.time()
+        try:
+            text_so_far = "".join(parts)
+            await edit_reply(message, preview(text_so_far) if preview else text_so_far)
+        except TelegramError as e:
+            logging.warning(f"Failed to update streamed message: {e}")
+
+    try:
+        response_text = await generate_llm_response(system_prompt, user_message, phrase=phrase, on_chunk=on_chunk)
+    except Exception:
+        try:
+            await message.delete()
+        except TelegramError as e:
+            logging.warning(f"Failed to delete streamed message: {e}")
+        raise
+    return message, response_text
+
+
 async def handle_english_only_generation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generates and sends only the English text."""
     user_message = update.message.text
     chat_id = update.effective_chat.id
 
-    system_prompt = """Given a sentence or a phrase.
-Task: create a text in English, consisting of 3-5 sentences, containing the given sentence or phrase.
-The result should be only the generated English text, without any other formatting or labels."""
-    
     try:
-        await context.bot.send_chat_action(chat_id=chat_id, action='typing')
-        response_text = await generate_llm_response(system_prompt, f"Phrase: {user_message}")
-        
-        await context.bot.send_message(chat_id=chat_id, text=response_text)
+        message, response_text = await stream_reply(
+            context, chat_id, _SYS_ENGLISH_ONLY, f"Phrase: {user_message}", user_message
+        )
+        await edit_reply(message, response_text)
         await context.bot.send_message(chat_id=chat_id, text="Send me another phrase.")
         
     except Exception as e:
@@ -221,35 +716,25 @@ The result should be only the generated English text, without any other formatti
 
 
 async def handle_explain_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Explains a word or phrase as an English teacher, with a fallback for Markdown errors."""
+    """Explains a word or phrase as an English teacher."""
     user_message = update.message.text
     chat_id = update.effective_chat.id
 
-    system_prompt = """You are an English teacher. The user will provide a word or a phrase.
-Your task is to explain its meaning in simple English. Provide a clear definition and 2-3 examples of modern use.
-Format the response using Telegram's MarkdownV2 style.
-- Use *bold* for the main word/phrase.
-- Use _italic_ for emphasis.
-- Use bullet points starting with a hyphen '-'.
-- IMPORTANT: You MUST escape the characters `_`, `*`, `[`, `]`, `(`, `)`, `~`, `` ` ``, `>`, `#`, `+`, `-`, `=`, `|`, `{`, `}`, `.`, `!` in all other text by preceding them with a backslash `\`. For example, write `a\.b` instead of `a.b`."""
-    
     try:
-        await context.bot.send_chat_action(chat_id=chat_id, action='typing')
-        response_text = await generate_llm_response(system_prompt, f"Word/Phrase: {user_message}")
-        
+        message, response_text = await stream_reply(
+            context, chat_id, _SYS_EXPLAIN, f"Word/Phrase: {user_message}", user_message,
+            preview=strip_markup
+        )
+
         try:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=response_text,
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
+            await edit_reply(message, to_markdown_v2(response_text), parse_mode=ParseMode.MARKDOWN_V2)
         except BadRequest as e:
             if "Can't parse entities" in str(e):
                 logging.warning(
                     f"MarkdownV2 parsing failed for text: '{response_text}'. "
                     f"Error: {e}. Sending as plain text."
                 )
-                await context.bot.send_message(chat_id=chat_id, text=response_text)
+                await edit_reply(message, strip_markup(response_text))
             else:
                 raise e
 
@@ -260,13 +745,55 @@ Format the response using Telegram's MarkdownV2 style.
         await context.bot.send_message(chat_id=chat_id, text="An error occurred. Please try again.")
 
 
+async def post_init(application):
+    """Starts the background message workers."""
+    for _ in range(MESSAGE_WORKERS):
+        message_workers.append(asyncio.create_task(message_worker()))
+
+
+async def post_shutdown(application):
+    """Stops the message workers and closes long-lived LLM clients when the bot stops."""
+    for worker in message_workers:
+        worker.cancel()
+    await asyncio.gather(*message_workers, return_exceptions=True)
+    if gigachat_client is not None:
+        await gigachat_client.aclose()
+    if llm_http_client is not None:
+        await llm_http_client.aclose()
+    if redis_client is not None:
+        await redis_client.aclose()
+
+
 if __name__ == '__main__':
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logging.info("Using uvloop event loop.")
+    except ImportError:
+        logging.info("uvloop is not installed, using the default asyncio event loop.")
+
+    persistence = PicklePersistence(
+        filepath=STATE_FILE,
+        store_data=PersistenceInput(bot_data=False, user_data=False, callback_data=False),
+    )
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .persistence(persistence)
+        # Throttles every outbound Bot API call to Telegram's flood limits and retries on RetryAfter
+        .rate_limiter(AIORateLimiter(max_retries=2))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    application.add_handler(CommandHandler('start', start))
-    application.add_handler(CommandHandler('mode', mode_command))
+    # Updates from anyone but the owner are dropped by the dispatcher before any handler runs
+    owner_filter = filters.User(user_id=OWNER_ID)
+    application.add_handler(CommandHandler('start', queued(start), filters=owner_filter))
+    application.add_handler(CommandHandler('mode', mode_command, filters=owner_filter))
+    application.add_handler(CommandHandler('stats', stats_command, filters=owner_filter))
     application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND) & owner_filter, queued(handle_message)))
 
     print(f"Bot is running with LLM Provider: {LLM_PROVIDER}. Press Ctrl+C to stop.")
     application.run_polling()
\ No newline at end of file